@@ -1,12 +1,22 @@
-import requests 
+import io
 import json
+import pickle
+import sqlite3
 import logging
 import os
 import datetime
-import tempfile
+import hashlib
+import hmac
+import time
+import threading
 import asyncio
+import functools
+from dataclasses import dataclass, field, fields
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, PhotoSize
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -14,14 +24,22 @@ from telegram.ext import (
     filters,
     ConversationHandler,
     ContextTypes,
+    CallbackContext,
+    ExtBot,
     CallbackQueryHandler,
-    PicklePersistence,
+    BasePersistence,
+    PersistenceInput,
     Application
 )
+import httpx
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from pydrive.auth import GoogleAuth
-from pydrive.drive import GoogleDrive
+from PIL import Image
+from google.oauth2 import service_account
+import google.auth.transport.requests
+import google_auth_httplib2
+import httplib2
+from googleapiclient.discovery import build
+from googleapiclient.http import MediaIoBaseUpload
 
 # ========================== CONFIG ==========================
 TOKEN = os.environ.get("TOKEN")
@@ -36,25 +54,58 @@ ADMIN_WHATSAPP_NUMBER = os.environ.get("ADMIN_WHATSAPP_NUMBER")
 
 SHEET_ID = "1RicQuJRGK5ZmlVZGGRZmU-mEtbYx_4kmzzsLPcgdyFE"
 DRIVE_FOLDER_ID = "14bDZ23j2jhXLWs_XxFb3xnOr-8GPlQhj"
+DRIVE_PARENTS = [DRIVE_FOLDER_ID]
+GOOGLE_TOKEN_REFRESH_INTERVAL = 1500  # seconds; well inside the 1 hour token lifetime
+PHOTO_MAX_SIDE = 1280  # px; doubt photos only need to be legible
+GOOGLE_HTTP_TIMEOUT = 60  # seconds per Sheets/Drive request, so a hung call cannot stall the doubt writer
 
 EXAM_OPTIONS = ["CBSE", "ICSE", "School Exam", "JEE", "NEET", "Other Competitive"]
 
 # ========================== GOOGLE API Setup ==========================
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds_dict = json.loads(GOOGLE_CREDS_JSON)
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-client = gspread.authorize(creds)
 
-if creds.access_token_expired:
-    client.login()
-
-doubts_sheet = client.open_by_key(SHEET_ID).worksheet("Doubts")
-users_sheet = client.open_by_key(SHEET_ID).worksheet("Users")
-blacklist_sheet = client.open_by_key(SHEET_ID).worksheet("Blacklisted")
-
-gauth = GoogleAuth()
-gauth.credentials = creds
-drive = GoogleDrive(gauth)
+# These are filled in by init_google() from the application's post_init hook, so
+# importing this module does no network I/O. The client and worksheet handles are
+# process-wide and opened exactly once: handlers must use these globals and never
+# call open_by_key()/worksheet() per request, which costs several extra HTTP calls.
+creds = None
+client = None
+spreadsheet = None
+doubts_sheet = None
+users_sheet = None
+blacklist_sheet = None
+drive_service = None
+
+def _authorize_google():
+    global creds, client, drive_service
+    creds = service_account.Credentials.from_service_account_info(json.loads(GOOGLE_CREDS_JSON), scopes=scope)
+    client = gspread.authorize(creds)
+
+    # Every Sheets call goes through one keep-alive pool, so the TLS handshake is paid
+    # once rather than per request. Idempotent requests are retried on 429/5xx; the
+    # last response is still handed back to gspread so it raises its usual APIError.
+    http_client = client.http_client if hasattr(client, "http_client") else client
+    http_client.set_timeout(GOOGLE_HTTP_TIMEOUT)
+    sheets_session = http_client.session
+    sheets_session.mount("https://", HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False),
+    ))
+
+    drive_service = build('drive', 'v3', credentials=creds, cache_discovery=False)
+
+async def init_google(app: Application):
+    """Authorizes the Google clients and opens the spreadsheet and its three worksheets."""
+    global spreadsheet, doubts_sheet, users_sheet, blacklist_sheet
+    logging.info("Connecting to Google Sheets and Drive...")
+    await _sheet(_authorize_google)
+    # One open plus one worksheets() listing, instead of an open and a lookup per tab.
+    spreadsheet = await _sheet(client.open_by_key, SHEET_ID)
+    worksheets = {ws.title: ws for ws in await _sheet(spreadsheet.worksheets)}
+    doubts_sheet = worksheets["Doubts"]
+    users_sheet = worksheets["Users"]
+    blacklist_sheet = worksheets["Blacklisted"]
 
 # ========================== TELEGRAM BOT ==========================
 logging.basicConfig(
@@ -68,30 +119,357 @@ logging.basicConfig(
     LOGGED_IN
 ) = range(9)
 
+# ========================== SESSION ==========================
+@dataclass(slots=True)
+class Session:
+    """Per-user conversation state; used as context.user_data in place of a dict."""
+    phone: str = ''
+    name: str = ''
+    signup_name: str = ''
+    signup_phone: str = ''
+    signup_class: str = ''
+    selected_exams: set = field(default_factory=set)
+    login_data: list = field(default_factory=list)
+
+    def clear(self):
+        # Resets every field to its default, like dict.clear() did.
+        self.__init__()
+
+CONTEXT_TYPES = ContextTypes(user_data=Session)
+BotContext = CallbackContext[ExtBot, Session, dict, dict]
+
 # ========================== HELPER FUNCTIONS ==========================
 
-def get_blacklist(context: ContextTypes.DEFAULT_TYPE) -> set:
-    current_time = datetime.datetime.now()
-    if 'blacklist' not in context.bot_data or \
-       (current_time - context.bot_data.get('blacklist_last_updated', datetime.datetime.min)).total_seconds() > 300:
+# gspread and the Drive client are synchronous; their HTTP calls run on this pool so the
+# event loop keeps serving other chats while Google responds. Sized to fit within the
+# gspread connection pool (pool_maxsize=16) so threads never queue for a socket.
+SHEETS_POOL_SIZE = 8
+_executor = ThreadPoolExecutor(max_workers=SHEETS_POOL_SIZE)
+
+async def _sheet(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, lambda: fn(*args, **kwargs))
+
+_ts_cache = [0, ""]
+
+def now_str() -> str:
+    """Current local time as used in the Doubts sheet, formatted at most once per second."""
+    t = int(time.time())
+    if t != _ts_cache[0]:
+        _ts_cache[:] = [t, datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")]
+    return _ts_cache[1]
+
+def _age(stamp: float | None) -> float:
+    """Seconds since a time.monotonic() stamp; a missing stamp counts as infinitely old.
+    The monotonic clock counts from boot, so stamps must never be persisted across restarts."""
+    if stamp is None:
+        return float('inf')
+    return time.monotonic() - stamp
+
+# The blacklist and Users index are reloaded by the refresh_sheet_caches job, so handlers
+# normally never wait on Sheets. They only reload on demand if the job has fallen behind.
+SHEET_CACHE_REFRESH_INTERVAL = 300  # seconds
+SHEET_CACHE_MAX_AGE = 2 * SHEET_CACHE_REFRESH_INTERVAL
+SHEET_CACHE_FIRST_REFRESH = 30  # seconds; retries a failed startup warm-up well before the first interval
+SHEET_CACHE_RETRY_DELAY = 30  # seconds a stale copy is served after a failed on-demand reload
+
+# Kept out of bot_data: persistence would otherwise rewrite the whole Users sheet, PINs
+# included, on every flush. Both are rebuilt from the sheet by warm_caches() at startup.
+_sheet_cache: dict = {}
+
+# Serialise refreshes so a burst of lookups after expiry triggers a single fetch.
+_blacklist_lock = asyncio.Lock()
+_users_index_lock = asyncio.Lock()
+
+async def refresh_blacklist(max_age: float = 0):
+    """Reloads the blacklist unless the cached copy is younger than max_age seconds."""
+    async with _blacklist_lock:
+        if 'blacklist' in _sheet_cache and (
+            _age(_sheet_cache.get('blacklist_last_updated')) <= max_age
+            or _age(_sheet_cache.get('blacklist_last_failed')) <= SHEET_CACHE_RETRY_DELAY
+        ):
+            return
         logging.info("Refreshing blacklist from Google Sheet...")
-        blacklisted_numbers = blacklist_sheet.col_values(1)[1:]
-        context.bot_data['blacklist'] = set(blacklisted_numbers)
-        context.bot_data['blacklist_last_updated'] = current_time
-    return context.bot_data['blacklist']
-
-async def is_user_blacklisted(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    phone = context.user_data.get('phone')
+        try:
+            _store_blacklist((await _sheet(blacklist_sheet.col_values, 1))[1:])
+        except Exception as e:
+            # Without any copy the paywall must fail closed; otherwise keep enforcing the stale one.
+            if 'blacklist' not in _sheet_cache:
+                raise
+            _sheet_cache['blacklist_last_failed'] = time.monotonic()
+            logging.warning(f"Could not refresh blacklist, using the cached copy: {e}")
+
+def _store_blacklist(blacklisted_numbers: list):
+    _sheet_cache['blacklist'] = frozenset(blacklisted_numbers)
+    _sheet_cache['blacklist_last_updated'] = time.monotonic()
+
+async def get_blacklist() -> frozenset:
+    # Only raises if the sheet is unreachable and no copy was ever loaded, so the paywall never fails open.
+    await refresh_blacklist(max_age=SHEET_CACHE_MAX_AGE)
+    return _sheet_cache['blacklist']
+
+async def is_user_blacklisted(update: Update, context: BotContext) -> bool:
+    phone = context.user_data.phone
     if not phone:
         return True
-    if phone in get_blacklist(context):
+    if phone in await get_blacklist():
         await update.message.reply_text("Oops! Your access to unlimited doubt-solving has ended. To keep getting those tricky questions answered in a snap, please top up your plan. Click on the link below to recharge:\n\n https://pages.razorpay.com/stores/st_QNHI3mHvLWmx9D")
         context.user_data.clear()
         return True
     return False
 
+async def refresh_users_index(max_age: float = 0):
+    """Reloads the Users index unless the cached copy is younger than max_age seconds."""
+    async with _users_index_lock:
+        if 'users_index' in _sheet_cache and (
+            _age(_sheet_cache.get('users_index_last_updated')) <= max_age
+            or _age(_sheet_cache.get('users_index_last_failed')) <= SHEET_CACHE_RETRY_DELAY
+        ):
+            return
+        logging.info("Refreshing users index from Google Sheet...")
+        try:
+            _store_users_index((await _sheet(users_sheet.get_all_values))[1:])
+        except Exception as e:
+            if 'users_index' not in _sheet_cache:
+                raise
+            _sheet_cache['users_index_last_failed'] = time.monotonic()
+            logging.warning(f"Could not refresh users index, using the cached copy: {e}")
+
+# Rows appended by signup_pin, re-applied to every reload until the sheet snapshot includes them,
+# since a snapshot read just before the append can be stored just after it.
+_added_users: dict = {}
+
+def _store_users_index(rows: list):
+    """Indexes Users rows (header excluded) by phone; the first row for a phone wins, like find()."""
+    index = {}
+    for row_number, row in enumerate(rows, start=2):
+        if row:
+            index.setdefault(row[0], (row_number, row))
+    for phone, entry in list(_added_users.items()):
+        if phone in index:
+            del _added_users[phone]
+        else:
+            index[phone] = entry
+    _sheet_cache['users_index'] = index
+    _sheet_cache['users_index_last_updated'] = time.monotonic()
+
+async def add_to_users_index(phone: str, row_number: int, row: list):
+    """Records a just-appended Users row without reloading the sheet."""
+    async with _users_index_lock:
+        _added_users[phone] = (row_number, row)
+        if 'users_index' in _sheet_cache:
+            _sheet_cache['users_index'][phone] = (row_number, row)
+
+async def get_users_index() -> dict:
+    """Maps each registered phone number to (row number, row values) for the whole Users sheet."""
+    await refresh_users_index(max_age=SHEET_CACHE_MAX_AGE)
+    return _sheet_cache['users_index']
+
+USERS_COLUMNS = 7  # phone, telegram id, name, class, exams, PIN, signed up at
+
+async def load_sheet_caches():
+    """Reloads the Users index and the blacklist together with one values.batchGet request."""
+    logging.info("Refreshing users index and blacklist from Google Sheet...")
+    response = await _sheet(spreadsheet.values_batch_get, ['Users!A:G', 'Blacklisted!A:A'])
+    users_range, blacklist_range = response['valueRanges']
+    # batchGet trims empty trailing cells; pad rows back to A:G like get_all_values() does.
+    users_rows = [row + [''] * (USERS_COLUMNS - len(row)) for row in users_range.get('values', [])[1:]]
+    async with _users_index_lock:
+        _store_users_index(users_rows)
+    async with _blacklist_lock:
+        _store_blacklist([row[0] for row in blacklist_range.get('values', [])[1:] if row])
+
+async def refresh_sheet_caches(context: BotContext):
+    try:
+        await load_sheet_caches()
+    except Exception as e:
+        logging.warning(f"Could not refresh Google Sheet caches: {e}")
+
+async def get_user_row(phone: str) -> list | None:
+    """Returns the Users sheet row for a phone number, or None if it is not registered."""
+    entry = (await get_users_index()).get(phone)
+    return entry[1] if entry else None
+
+def _pin_digest(pin: str) -> str:
+    # Fixed-length digests let compare_digest() run in constant time whatever was typed.
+    return hashlib.blake2b(pin.encode(), digest_size=16).hexdigest()
+
+# httplib2.Http is not thread-safe, so each executor thread keeps its own authorised connection.
+_drive_http = threading.local()
+
+def _thread_drive_http() -> google_auth_httplib2.AuthorizedHttp:
+    if not hasattr(_drive_http, "http"):
+        _drive_http.http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=GOOGLE_HTTP_TIMEOUT))
+    return _drive_http.http
+
+def pick_photo_size(sizes):
+    """Returns the smallest Telegram size that still covers PHOTO_MAX_SIDE, or the largest one."""
+    large_enough = [size for size in sizes if max(size.width, size.height) >= PHOTO_MAX_SIDE]
+    if large_enough:
+        return min(large_enough, key=lambda size: size.width * size.height)
+    return max(sizes, key=lambda size: size.width * size.height)
+
+def shrink_photo(data: bytes) -> bytes:
+    """Downscales a photo to PHOTO_MAX_SIDE and re-encodes it as JPEG (blocking)."""
+    image = Image.open(io.BytesIO(data))
+    if max(image.size) <= PHOTO_MAX_SIDE:
+        return data
+    image.thumbnail((PHOTO_MAX_SIDE, PHOTO_MAX_SIDE))
+    out = io.BytesIO()
+    image.convert("RGB").save(out, 'JPEG', quality=85, optimize=True)
+    return out.getvalue()
+
+def upload_to_drive(data: bytes, filename: str) -> str:
+    """Uploads an in-memory JPEG to the doubts Drive folder and returns its file id (blocking)."""
+    media = MediaIoBaseUpload(io.BytesIO(data), mimetype='image/jpeg', resumable=False)
+    request = drive_service.files().create(
+        body={'name': filename, 'parents': DRIVE_PARENTS},
+        media_body=media,
+        fields='id'
+    )
+    return request.execute(http=_thread_drive_http())['id']
+
+def _refresh_google_token():
+    # gspread and the Drive client share this credentials object, so one refresh covers both.
+    # google-auth keeps expiry as naive UTC, so compare it with a naive UTC "now".
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    if not creds.valid or creds.expiry is None or \
+       (creds.expiry - now).total_seconds() < GOOGLE_TOKEN_REFRESH_INTERVAL:
+        logging.info("Refreshing Google access token...")
+        creds.refresh(google.auth.transport.requests.Request())
+
+async def refresh_google_token(context: BotContext):
+    """Refreshes the service-account token ahead of expiry so uploads never stop to do it."""
+    try:
+        await _sheet(_refresh_google_token)
+    except Exception as e:
+        logging.warning(f"Could not refresh Google access token: {e}")
+
+# ========================== DOUBT WRITER ==========================
+# Handlers only enqueue a DoubtJob and reply. A single background task drains the
+# queue in batches: it uploads the batch's photos to Drive concurrently, fills in
+# their links, then writes all rows with one append_rows call.
+DOUBT_BATCH_SIZE = 50
+DOUBT_BATCH_WAIT = 3  # seconds
+DRIVE_LINK_COLUMN = 5
+DRIVE_UPLOAD_CONCURRENCY = SHEETS_POOL_SIZE // 2  # leaves worker threads free for Sheets calls during photo bursts
+TELEGRAM_DOWNLOAD_CONCURRENCY = 16  # half of connection_pool_size(32), so photo bursts cannot starve replies
+# Failed uploads and writes back off exponentially from DOUBT_BATCH_WAIT up to DOUBT_RETRY_MAX_DELAY.
+# A photo that still fails after DOUBT_PHOTO_MAX_ATTEMPTS is dropped and its row written without it.
+DOUBT_RETRY_MAX_DELAY = 300  # seconds
+DOUBT_PHOTO_MAX_ATTEMPTS = 5
+DRIVE_UPLOAD_FAILED = "Photo upload failed"
+
+@dataclass
+class DoubtJob:
+    row: list
+    photo: bytes | None = None
+    photo_name: str = ''
+    attempts: int = 0
+    retry_at: float = 0  # event-loop time before which the job is not retried
+
+    def backoff(self):
+        self.attempts += 1
+        delay = min(DOUBT_BATCH_WAIT * 2 ** (self.attempts - 1), DOUBT_RETRY_MAX_DELAY)
+        self.retry_at = asyncio.get_running_loop().time() + delay
+
+_doubt_queue: asyncio.Queue = asyncio.Queue(maxsize=1000)
+_doubt_writer_task: asyncio.Task | None = None
+_drive_upload_slots = asyncio.Semaphore(DRIVE_UPLOAD_CONCURRENCY)
+_telegram_download_slots = asyncio.Semaphore(TELEGRAM_DOWNLOAD_CONCURRENCY)
+
+async def _append_doubt(row: list, photo: tuple[bytes, str] | None = None):
+    """Queues one Doubts row (and its photo, if any), waiting for room; for background tasks only."""
+    await _doubt_queue.put(DoubtJob(row, *photo) if photo else DoubtJob(row))
+
+async def _next_doubt_batch(wait_first: bool) -> tuple[list[DoubtJob], bool]:
+    """Collects up to DOUBT_BATCH_SIZE jobs, waiting at most DOUBT_BATCH_WAIT after the first.
+    The second value is True once the shutdown sentinel has been seen."""
+    batch = []
+    if wait_first:
+        job = await _doubt_queue.get()
+        if job is None:
+            return batch, True
+        batch.append(job)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DOUBT_BATCH_WAIT
+    while len(batch) < DOUBT_BATCH_SIZE:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            job = await asyncio.wait_for(_doubt_queue.get(), remaining)
+        except asyncio.TimeoutError:
+            break
+        if job is None:
+            return batch, True
+        batch.append(job)
+    return batch, False
+
+async def _upload_doubt_photo(job: DoubtJob):
+    try:
+        async with _drive_upload_slots:
+            drive_file_id = await _sheet(upload_to_drive, job.photo, job.photo_name)
+    except Exception as e:
+        job.backoff()
+        if job.attempts < DOUBT_PHOTO_MAX_ATTEMPTS:
+            logging.error(f"Failed to upload {job.photo_name} to Drive, will retry: {e}")
+            return
+        logging.error(f"Giving up on uploading {job.photo_name} after {job.attempts} attempts: {e}")
+        job.row[DRIVE_LINK_COLUMN] = DRIVE_UPLOAD_FAILED
+    else:
+        job.row[DRIVE_LINK_COLUMN] = f"https://drive.google.com/uc?id={drive_file_id}"
+    job.photo = None
+
+async def _write_doubts(batch: list[DoubtJob], force: bool = False) -> list[DoubtJob]:
+    """Uploads the batch's photos and appends its rows; returns the jobs that still need writing.
+    Jobs still backing off are passed over unless force is set."""
+    now = asyncio.get_running_loop().time()
+    due = [job for job in batch if force or job.retry_at <= now]
+    waiting = [job for job in batch if not (force or job.retry_at <= now)]
+    await asyncio.gather(*(_upload_doubt_photo(job) for job in due if job.photo))
+    # Jobs whose photo failed to upload keep it and are held back for a later batch.
+    ready = [job for job in due if not job.photo]
+    held = [job for job in due if job.photo]
+    if ready:
+        try:
+            await _sheet(doubts_sheet.append_rows, [job.row for job in ready], value_input_option="RAW")
+            logging.info(f"Wrote {len(ready)} doubt(s) to Google Sheet.")
+        except Exception as e:
+            logging.error(f"Failed to write {len(ready)} doubt(s), will retry: {e}")
+            for job in ready:
+                job.backoff()
+            held = ready + held
+    return waiting + held
+
+async def doubt_writer():
+    retry = []
+    stopping = False
+    while not stopping:
+        batch, stopping = await _next_doubt_batch(wait_first=not retry)
+        # One last attempt for everything on shutdown, whatever its backoff.
+        retry = await _write_doubts(retry + batch, force=stopping)
+    if retry:
+        logging.error(f"Shutting down with {len(retry)} unwritten doubt(s): {[job.row for job in retry]}")
+
+async def stop_doubt_writer(app: Application):
+    """Lets the writer drain everything already queued, then waits for it to exit."""
+    if _doubt_writer_task:
+        await _doubt_queue.put(None)
+        await _doubt_writer_task
+
 # ========================== NEW NOTIFICATION FUNCTION ==========================
-def send_whatsapp_notification(name: str, phone: str, user_class: str):
+# Shared keep-alive client for Ultramsg, closed in the application's post_shutdown hook.
+# The transport retries failed connection attempts only, so a POST is never sent twice.
+_http = httpx.AsyncClient(
+    timeout=5.0,
+    transport=httpx.AsyncHTTPTransport(http2=True, retries=2, limits=httpx.Limits(max_keepalive_connections=10))
+)
+
+async def close_http_client(app: Application):
+    await _http.aclose()
+
+async def send_whatsapp_notification(name: str, phone: str, user_class: str):
     """Sends a WhatsApp notification to the admin using Ultramsg API."""
     if not all([ULTRAMSG_INSTANCE_ID, ULTRAMSG_TOKEN, ADMIN_WHATSAPP_NUMBER]):
         logging.warning("Ultramsg credentials not set. Skipping WhatsApp notification.")
@@ -117,31 +495,36 @@ def send_whatsapp_notification(name: str, phone: str, user_class: str):
     headers = {'Content-type': 'application/x-www-form-urlencoded'}
     
     try:
-        response = requests.post(url, data=params, headers=headers)
+        response = await _http.post(url, data=params, headers=headers)
         response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
         logging.info(f"Successfully sent WhatsApp notification for user {name}.")
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error(f"Failed to send WhatsApp notification: {e}")
 
 # ========================== AUTHENTICATION FLOW ==========================
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if context.user_data.get('phone'):
+WELCOME_TEXT = "Welcome!\nNote : If bot freezes or doesn't respond please use /cancel and then restart the bot by /start\nHelpline 📞: 9625060017\n\nFor payment after free trial ends use this link (Browse Plans) : https://rzp.io/rzp/HgGGEvWO\nNote: After recharge bot may take upto 3 hours to update your account, please kindly have patience \n\nPlease log in or sign up to continue:"
+START_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Login", callback_data='login')],
+    [InlineKeyboardButton("✍️ Signup", callback_data='signup')]
+])
+
+async def start(update: Update, context: BotContext) -> int:
+    if context.user_data.phone:
         if await is_user_blacklisted(update, context):
             pass
         else:
             await update.message.reply_text("Great to see you again! You're still logged in. Let's crush those doubts and keep your preparation on track.\n\nWhat's your question?")
             return LOGGED_IN
 
-    keyboard = [[InlineKeyboardButton("✅ Login", callback_data='login')], [InlineKeyboardButton("✍️ Signup", callback_data='signup')]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = START_MARKUP
     if update.callback_query:
-        await update.callback_query.edit_message_text("Welcome!\nNote : If bot freezes or doesn't respond please use /cancel and then restart the bot by /start\nHelpline 📞: 9625060017\n\nFor payment after free trial ends use this link (Browse Plans) : https://rzp.io/rzp/HgGGEvWO\nNote: After recharge bot may take upto 3 hours to update your account, please kindly have patience \n\nPlease log in or sign up to continue:", reply_markup=reply_markup)
+        await update.callback_query.edit_message_text(WELCOME_TEXT, reply_markup=reply_markup)
     else:
-        await update.message.reply_text("Welcome! \nNote : If bot freezes or doesn't respond please use /cancel and then restart the bot by /start\nHelpline 📞: 9625060017\n\nFor payment after free trial ends use this link (Browse Plans) : https://rzp.io/rzp/HgGGEvWO\nNote: After recharge bot may take upto 3 hours to update your account, please kindly have patience \n\nPlease log in or sign up to continue:", reply_markup=reply_markup)
+        await update.message.reply_text(WELCOME_TEXT, reply_markup=reply_markup)
     return AUTH_DECISION
 
-async def auth_decision_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def auth_decision_callback(update: Update, context: BotContext) -> int:
     query = update.callback_query
     await query.answer()
     if query.data == 'login':
@@ -151,81 +534,89 @@ async def auth_decision_callback(update: Update, context: ContextTypes.DEFAULT_T
         await query.edit_message_text("Great! Let's get you signed up. What is your full name?")
         return SIGNUP_NAME
 
-async def signup_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data['signup_name'] = update.message.text.strip()
+async def signup_name(update: Update, context: BotContext) -> int:
+    context.user_data.signup_name = update.message.text.strip()
     await update.message.reply_text("Got it. Now, please enter your phone number:")
     return SIGNUP_PHONE
 
-async def signup_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def signup_phone(update: Update, context: BotContext) -> int:
     phone = update.message.text.strip()
-    try:
-        cell = users_sheet.find(phone, in_column=1)
-        if cell:
-            await update.message.reply_text("This phone number is already registered. Please log in instead using /start.")
-            return ConversationHandler.END
-    except gspread.exceptions.CellNotFound:
-        pass
-    context.user_data['signup_phone'] = phone
+    if phone in await get_users_index():
+        await update.message.reply_text("This phone number is already registered. Please log in instead using /start.")
+        return ConversationHandler.END
+    context.user_data.signup_phone = phone
     await update.message.reply_text("Thanks. Which class are you in?")
     return SIGNUP_CLASS
 
-async def signup_class(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data['signup_class'] = update.message.text.strip()
-    context.user_data['selected_exams'] = set()
-    keyboard = [[InlineKeyboardButton(exam, callback_data=f"exam_{exam}")] for exam in EXAM_OPTIONS]
-    keyboard.append([InlineKeyboardButton("➡️ Done", callback_data="exam_done")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+EXAM_DONE_CB = "exam_done"
+_EXAM_CB = {exam: f"exam_{exam}" for exam in EXAM_OPTIONS}
+_EXAM_CB_REV = {callback_data: exam for exam, callback_data in _EXAM_CB.items()}
+
+# There are only 2**len(EXAM_OPTIONS) possible keyboards, so each is built once and reused.
+@functools.lru_cache(maxsize=None)
+def exam_keyboard(selected_exams: frozenset) -> InlineKeyboardMarkup:
+    keyboard = []
+    for exam in EXAM_OPTIONS:
+        text = f"✅ {exam}" if exam in selected_exams else exam
+        keyboard.append([InlineKeyboardButton(text, callback_data=_EXAM_CB[exam])])
+    keyboard.append([InlineKeyboardButton("➡️ Done", callback_data=EXAM_DONE_CB)])
+    return InlineKeyboardMarkup(keyboard)
+
+INITIAL_EXAM_MARKUP = exam_keyboard(frozenset())
+
+async def signup_class(update: Update, context: BotContext) -> int:
+    context.user_data.signup_class = update.message.text.strip()
+    context.user_data.selected_exams = set()
+    reply_markup = INITIAL_EXAM_MARKUP
     await update.message.reply_text("Which exam(s) are you preparing for?\nSelect (multiple options) then press Done", reply_markup=reply_markup)
     return SIGNUP_EXAMS
 
-async def signup_exams_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def signup_exams_callback(update: Update, context: BotContext) -> int:
     query = update.callback_query
     await query.answer()
-    action = query.data.split('_', 1)[1]
-    if action == "done":
+    if query.data == EXAM_DONE_CB:
         await query.edit_message_text("Perfect. Lastly, please create a 4-digit PIN for your account:")
         return SIGNUP_PIN
-    selected_exams = context.user_data.get('selected_exams', set())
-    if action in selected_exams:
-        selected_exams.remove(action)
+    exam = _EXAM_CB_REV.get(query.data)
+    if exam is None:
+        return SIGNUP_EXAMS
+    selected_exams = context.user_data.selected_exams
+    if exam in selected_exams:
+        selected_exams.remove(exam)
     else:
-        selected_exams.add(action)
-    context.user_data['selected_exams'] = selected_exams
-    keyboard = []
-    for exam in EXAM_OPTIONS:
-        text = f"✅ {exam}" if exam in selected_exams else exam
-        keyboard.append([InlineKeyboardButton(text, callback_data=f"exam_{exam}")])
-    keyboard.append([InlineKeyboardButton("➡️ Done", callback_data="exam_done")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_reply_markup(reply_markup)
+        selected_exams.add(exam)
+    await query.edit_message_reply_markup(exam_keyboard(frozenset(selected_exams)))
     return SIGNUP_EXAMS
 
 # ========================== MODIFIED SIGNUP FUNCTION ==========================
-async def signup_pin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def signup_pin(update: Update, context: BotContext) -> int:
     pin = update.message.text.strip()
-    if not (pin.isdigit() and len(pin) == 4):
+    if len(pin) != 4 or not pin.isdigit():
         await update.message.reply_text("Invalid PIN. Please enter a 4-digit number.")
         return SIGNUP_PIN
         
-    user_data = context.user_data
+    session = context.user_data
     timestamp = datetime.datetime.now().isoformat()
-    exams_str = ", ".join(sorted(list(user_data['selected_exams'])))
+    exams_str = ", ".join(sorted(list(session.selected_exams)))
     
-    new_user_name = user_data['signup_name']
-    new_user_phone = user_data['signup_phone']
-    new_user_class = user_data['signup_class']
+    new_user_name = session.signup_name
+    new_user_phone = session.signup_phone
+    new_user_class = session.signup_class
 
     new_row = [ new_user_phone, str(update.message.from_user.id), new_user_name, new_user_class, exams_str, pin, timestamp ]
     
     try:
-        users_sheet.append_row(new_row)
+        response = await _sheet(users_sheet.append_row, new_row)
+        updated_range = response['updates']['updatedRange'].rpartition('!')[2]
+        row_number, _ = gspread.utils.a1_to_rowcol(updated_range.split(':')[0])
+        await add_to_users_index(new_user_phone, row_number, new_row)
         
         # --- NEW: Call the notification function here ---
-        send_whatsapp_notification(
+        context.application.create_task(send_whatsapp_notification(
             name=new_user_name,
             phone=new_user_phone,
             user_class=new_user_class
-        )
+        ), update=update)
         # ----------------------------------------------
 
         context.user_data.clear()
@@ -237,17 +628,16 @@ async def signup_pin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         await update.message.reply_text("Sorry, there was a problem saving your details. Please try signing up again.")
         return await start(update, context)
 
-async def login_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def login_phone(update: Update, context: BotContext) -> int:
     phone = update.message.text.strip()
-    if phone in get_blacklist(context):
+    if phone in await get_blacklist():
         await update.message.reply_text("Oops! Your access to unlimited doubt-solving has ended. To keep getting those tricky questions answered in a snap, please top up your plan. Click on the link below to recharge:\n\n https://pages.razorpay.com/stores/st_QNHI3mHvLWmx9D")
         return ConversationHandler.END
     try:
-        cell = users_sheet.find(phone, in_column=1)
-        if not cell:
+        user_data = await get_user_row(phone)
+        if not user_data:
             raise gspread.exceptions.CellNotFound
-        user_data = users_sheet.row_values(cell.row)
-        context.user_data['login_data'] = user_data
+        context.user_data.login_data = user_data
         await update.message.reply_text("Phone number found. Please enter your 4-digit PIN:")
         return LOGIN_PIN
     except gspread.exceptions.CellNotFound:
@@ -258,17 +648,19 @@ async def login_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         await update.message.reply_text("Sorry, there was a problem connecting to our database. Please try again in a few moments.\nHelpline 📞: 9625060017")
         return ConversationHandler.END
 
-async def login_pin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def login_pin(update: Update, context: BotContext) -> int:
     pin = update.message.text.strip()
-    user_data_row = context.user_data['login_data']
-    correct_pin = user_data_row[5]
-    if pin == correct_pin:
+    # Re-read the row so a PIN reset in the sheet applies from the next index refresh.
+    user_data_row = await get_user_row(context.user_data.login_data[0]) or context.user_data.login_data
+    if hmac.compare_digest(_pin_digest(pin), _pin_digest(user_data_row[5])):
         stored_telegram_id = user_data_row[1]
         current_telegram_id = str(update.message.from_user.id)
         if stored_telegram_id == current_telegram_id:
             phone_number = user_data_row[0]
+            name = user_data_row[2]
             context.user_data.clear()
-            context.user_data['phone'] = phone_number
+            context.user_data.phone = phone_number
+            context.user_data.name = name
             await update.message.reply_text("✅ Login successful! You can now send your doubts.")
             return LOGGED_IN
         else:
@@ -278,58 +670,186 @@ async def login_pin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         await update.message.reply_text("Incorrect PIN. Please try the PIN again, or use /cancel to start over.")
         return LOGIN_PIN
 
-async def handle_doubt(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def _persist_photo_doubt(context: BotContext, row: list, photo: PhotoSize):
+    """Downloads and shrinks a photo doubt, then queues it. Runs after handle_doubt has replied,
+    so the update no longer holds a connection-pool slot while Telegram serves the file."""
+    try:
+        async with _telegram_download_slots:
+            file = await context.bot.get_file(photo.file_id)
+            photo_data = await file.download_as_bytearray()
+        photo_bytes = await _sheet(shrink_photo, bytes(photo_data))
+    except Exception as e:
+        # The user has already been told the doubt was recorded, so keep the row without the photo.
+        logging.error(f"Failed to download photo {photo.file_unique_id}, recording the doubt without it: {e}")
+        row[DRIVE_LINK_COLUMN] = DRIVE_UPLOAD_FAILED
+        await _append_doubt(row)
+        return
+    await _append_doubt(row, photo=(photo_bytes, f"{photo.file_unique_id}.jpg"))
+
+DOUBT_QUEUE_FULL_TEXT = "Sorry, we couldn't record your doubt right now. Please try again in a few minutes.\nHelpline 📞: 9625060017"
+
+async def handle_doubt(update: Update, context: BotContext):
     if await is_user_blacklisted(update, context):
         return
-    phone = context.user_data.get('phone')
+    phone = context.user_data.phone
     if not phone:
         await update.message.reply_text("An error occurred. Please log in again with /start.\nHelpline 📞: 9625060017")
         return
-    try:
-        cell = users_sheet.find(phone, in_column=1)
-        if not cell:
-            raise gspread.exceptions.CellNotFound
-        user_data = users_sheet.row_values(cell.row)
-        name = user_data[2]
-    except gspread.exceptions.CellNotFound:
-        await update.message.reply_text("An error occurred with your account. Please try logging in again with /start.\nHelpline 📞: 9625060017")
-        return
+    name = context.user_data.name
+    if not name:
+        # Sessions imported from the old pickle file have a phone but no cached name.
+        user_data = await get_user_row(phone)
+        if not user_data:
+            await update.message.reply_text("An error occurred with your account. Please try logging in again with /start.\nHelpline 📞: 9625060017")
+            return
+        name = context.user_data.name = user_data[2]
     user_id = update.message.from_user.id
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    now = now_str()
     whatsapp_link = f"https://wa.me/91{phone}"
-    text_doubt = "-"
-    drive_link = "-"
-    if update.message.photo:
-        text_doubt = update.message.caption or "-"
-        photo = update.message.photo[-1]
-        file = await context.bot.get_file(photo.file_id)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-            await file.download_to_drive(custom_path=temp_file.name)
-            gfile = drive.CreateFile({'parents': [{'id': DRIVE_FOLDER_ID}], 'title': os.path.basename(temp_file.name)})
-            gfile.SetContentFile(temp_file.name)
-            gfile.Upload()
-            drive_link = f"https://drive.google.com/uc?id={gfile['id']}"
-        os.unlink(temp_file.name)
+    photo = pick_photo_size(update.message.photo) if update.message.photo else None
+    text_doubt = (update.message.caption if photo else update.message.text) or "-"
+    row = [now, name, phone, str(user_id), text_doubt, "-", "Pending", whatsapp_link]
+    # The queue only fills up if the writer is stuck; refuse rather than block every other chat.
+    if photo:
+        if _doubt_queue.full():
+            await update.message.reply_text(DOUBT_QUEUE_FULL_TEXT)
+            return
         await update.message.reply_text("✅ Your image doubt has been recorded!")
-    elif update.message.text:
-        text_doubt = update.message.text
+        context.application.create_task(_persist_photo_doubt(context, row, photo), update=update)
+    else:
+        try:
+            _doubt_queue.put_nowait(DoubtJob(row))
+        except asyncio.QueueFull:
+            await update.message.reply_text(DOUBT_QUEUE_FULL_TEXT)
+            return
         await update.message.reply_text("✅ Your text doubt has been recorded!")
-    doubts_sheet.append_row([now, name, phone, str(user_id), text_doubt, drive_link, "Pending", whatsapp_link])
 
-async def logout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def logout(update: Update, context: BotContext) -> int:
     context.user_data.clear()
     await update.message.reply_text("You have been successfully logged out. Use /start to log in again.")
     return await start(update, context)
 
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def cancel(update: Update, context: BotContext) -> int:
     context.user_data.clear()
     await update.message.reply_text("Process cancelled. Use /start to begin again.\nHelpline 📞: 9625060017")
     return ConversationHandler.END
 
+# ========================== PERSISTENCE ==========================
+class _LegacyUnpickler(pickle.Unpickler):
+    # PicklePersistence stores the Bot by reference; sessions never contain one.
+    def persistent_load(self, pid):
+        return None
+
+class SQLitePersistence(BasePersistence):
+    """Keeps bot state in SQLite with one row per user/chat, so a flush only rewrites the users
+    and chats that changed. bot_data is rewritten in full each time, so it must stay small."""
+
+    def __init__(self, filepath: str, update_interval: float = 60, legacy_pickle: str | None = None):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self._conn = sqlite3.connect(filepath, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS bot_data (id INTEGER PRIMARY KEY CHECK (id = 0), data BLOB NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS conversations (name TEXT, key TEXT, state BLOB NOT NULL, PRIMARY KEY (name, key));"
+        )
+        if legacy_pickle and os.path.exists(legacy_pickle) and \
+           not self._conn.execute("SELECT 1 FROM user_data LIMIT 1").fetchone():
+            self._import_pickle(legacy_pickle)
+        # A single worker serialises all access to the connection and keeps disk I/O off the event loop.
+        self._db = ThreadPoolExecutor(max_workers=1)
+
+    def _import_pickle(self, path: str):
+        """One-time import of the user_data saved by the PicklePersistence this class replaced,
+        so logged-in users stay logged in across the switch. Unknown keys are dropped."""
+        try:
+            with open(path, "rb") as f:
+                user_data = _LegacyUnpickler(f).load().get("user_data", {})
+        except Exception as e:
+            logging.warning(f"Could not import sessions from {path}: {e}")
+            return
+        session_fields = {f.name for f in fields(Session)}
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO user_data VALUES (?, ?)", [
+                (user_id, pickle.dumps(Session(**{k: v for k, v in data.items() if k in session_fields})))
+                for user_id, data in user_data.items()
+            ])
+        logging.info(f"Imported {len(user_data)} session(s) from {path}.")
+
+    async def _run(self, sql: str, params: tuple = ()) -> list:
+        def execute():
+            with self._conn:
+                return self._conn.execute(sql, params).fetchall()
+        return await asyncio.get_running_loop().run_in_executor(self._db, execute)
+
+    async def _load_table(self, table: str) -> dict:
+        rows = await self._run(f"SELECT * FROM {table}")
+        return {key: pickle.loads(data) for key, data in rows}
+
+    async def get_user_data(self) -> dict:
+        return await self._load_table("user_data")
+
+    async def get_chat_data(self) -> dict:
+        return await self._load_table("chat_data")
+
+    async def get_bot_data(self) -> dict:
+        rows = await self._run("SELECT data FROM bot_data WHERE id = 0")
+        return pickle.loads(rows[0][0]) if rows else {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await self._run("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def update_user_data(self, user_id: int, data: Session) -> None:
+        await self._run("INSERT OR REPLACE INTO user_data VALUES (?, ?)", (user_id, pickle.dumps(data)))
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        await self._run("INSERT OR REPLACE INTO chat_data VALUES (?, ?)", (chat_id, pickle.dumps(data)))
+
+    async def update_bot_data(self, data: dict) -> None:
+        await self._run("INSERT OR REPLACE INTO bot_data VALUES (0, ?)", (pickle.dumps(data),))
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object | None) -> None:
+        if new_state is None:
+            await self._run("DELETE FROM conversations WHERE name = ? AND key = ?", (name, json.dumps(key)))
+        else:
+            await self._run("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)", (name, json.dumps(key), pickle.dumps(new_state)))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        await self._run("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        await self._run("DELETE FROM chat_data WHERE chat_id = ?", (chat_id,))
+
+    async def refresh_user_data(self, user_id: int, user_data: Session) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(self._db, self._conn.close)
+        self._db.shutdown()
+
+RESTART_NOTICE_RATE = 25  # messages per second, under Telegram's ~30/s broadcast limit
+
 async def notify_users_on_restart(app: Application):
     logging.info("Checking for logged-in users to notify about restart...")
-    for user_id, user_data in list(app.user_data.items()):
-        if user_data.get('phone'):
+    slots = asyncio.Semaphore(RESTART_NOTICE_RATE)
+
+    async def _notify(user_id: int):
+        async with slots:
             try:
                 await app.bot.send_message(
                     chat_id=user_id,
@@ -338,10 +858,49 @@ async def notify_users_on_restart(app: Application):
                 logging.info(f"Sent restart notification to user {user_id}")
             except Exception as e:
                 logging.warning(f"Could not send restart notification to user {user_id}: {e}")
+            # Each slot is held for at least a second, capping sends at RESTART_NOTICE_RATE per second.
+            await asyncio.sleep(1)
+
+    await asyncio.gather(*(
+        _notify(user_id) for user_id, user_data in list(app.user_data.items()) if user_data.phone
+    ))
+
+async def warm_caches(app: Application):
+    """Loads the blacklist and Users index before the restart notice brings everyone back at once."""
+    try:
+        await load_sheet_caches()
+    except Exception as e:
+        logging.warning(f"Could not pre-load Google Sheet caches: {e}")
+
+_restart_notice_task: asyncio.Task | None = None
+
+async def post_init(app: Application):
+    global _doubt_writer_task, _restart_notice_task
+    await init_google(app)
+    await warm_caches(app)
+    _doubt_writer_task = asyncio.create_task(doubt_writer())
+    # Runs in the background so the webhook comes up without waiting for every notice.
+    _restart_notice_task = asyncio.create_task(notify_users_on_restart(app))
 
 if __name__ == "__main__":
-    persistence = PicklePersistence(filepath="bot_session_data.pickle")
-    app = ApplicationBuilder().token(TOKEN).persistence(persistence).post_init(notify_users_on_restart).build()
+    # Row-level writes are cheap, so state is flushed every 10s instead of PTB's default 60s.
+    persistence = SQLitePersistence(
+        filepath="bot_session_data.sqlite3", update_interval=10, legacy_pickle="bot_session_data.pickle"
+    )
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .persistence(persistence)
+        .context_types(CONTEXT_TYPES)
+        .connection_pool_size(32)
+        .pool_timeout(30)
+        .post_init(post_init)
+        .post_stop(stop_doubt_writer)
+        .post_shutdown(close_http_client)
+        .build()
+    )
+    app.job_queue.run_repeating(refresh_google_token, interval=GOOGLE_TOKEN_REFRESH_INTERVAL, first=0)
+    app.job_queue.run_repeating(refresh_sheet_caches, interval=SHEET_CACHE_REFRESH_INTERVAL, first=SHEET_CACHE_FIRST_REFRESH)
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
         states={